@@ -2,14 +2,14 @@
 """
 Telegram Games Bot (base implementation)
 - Uses python-telegram-bot v13 (synchronous)
-- Simple SQLite persistence
+- Pluggable persistence (see storage.py): SQLite by default, in-memory for tests
 
 Edit BOT_TOKEN below or set the BOT_TOKEN env var.
+Set STORAGE_BACKEND=memory to run without touching the disk.
 """
 
 import os
 import logging
-import sqlite3
 import threading
 import random
 import time
@@ -23,6 +23,8 @@ from telegram.ext import (Updater, CommandHandler, MessageHandler,
                           Filters, CallbackQueryHandler, CallbackContext,
                           ChatMemberHandler)
 
+from storage import Game, create_repository
+
 # ===== CONFIG =====
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 if not BOT_TOKEN:
@@ -34,6 +36,8 @@ POINTS_PER_WIN = 5
 QUACKPOINTS_PER_POINT = 20
 
 DB_PATH = 'bot_data.db'
+# Storage backend: 'sqlite' (default, uses DB_PATH) or 'memory' (nothing persisted)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sqlite')
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -43,82 +47,13 @@ pending = {}
 # Active timers for Parole a Blocchi: {game_id: threading.Timer}
 timers = {}
 
-# ===== DB helpers =====
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS groups (
-            id INTEGER PRIMARY KEY,
-            title TEXT,
-            stored_at INTEGER
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS games (
-            id TEXT PRIMARY KEY,
-            type TEXT,
-            group_id INTEGER,
-            admin_id INTEGER,
-            secret TEXT,
-            state TEXT,
-            metadata TEXT,
-            created_at INTEGER
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS points (
-            user_id INTEGER,
-            group_id INTEGER,
-            points INTEGER,
-            PRIMARY KEY (user_id, group_id)
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS wins (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            group_id INTEGER,
-            points INTEGER,
-            ts INTEGER
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            group_id INTEGER,
-            ts INTEGER
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT,
-            text TEXT,
-            data TEXT,
-            ts INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def db_exec(query, params=(), fetch=False):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(query, params)
-    res = None
-    if fetch:
-        res = c.fetchall()
-    conn.commit()
-    conn.close()
-    return res
-
+# ===== Storage =====
+store = create_repository(STORAGE_BACKEND, DB_PATH)
 
 def log_event(event_type, text, data=None):
     try:
         payload = json.dumps(data, ensure_ascii=False) if data is not None else None
-        db_exec('INSERT INTO logs (type, text, data, ts) VALUES (?, ?, ?, ?)', (event_type, text, payload, int(time.time())))
+        store.add_log(event_type, text, payload, int(time.time()))
     except Exception:
         logger.exception('Failed to write log event')
 
@@ -166,8 +101,7 @@ def chat_member_update(update: Update, context: CallbackContext):
         # Bot status changed in this chat
         logger.info(f"Bot status changed in {chat.id}: {new.status}")
         # Save group
-        db_exec('INSERT OR REPLACE INTO groups (id, title, stored_at) VALUES (?, ?, ?)',
-                (chat.id, chat.title or '', int(time.time())))
+        store.save_group(chat.id, chat.title or '', int(time.time()))
         # Ask to make admin
         try:
             context.bot.send_message(chat.id, "Ciao! Mettimi Amministratore per far sì che tutto funzioni correttamente! 🙏")
@@ -192,7 +126,7 @@ def callback_query(update: Update, context: CallbackContext):
             page = 1
         per = 10
         offset = (page-1)*per
-        rows = db_exec('SELECT id, type, text, ts FROM logs ORDER BY id DESC LIMIT ? OFFSET ?', (per, offset), fetch=True)
+        rows = store.recent_logs(per, offset)
         if not rows:
             q.edit_message_text('Nessun log.')
             return
@@ -205,7 +139,7 @@ def callback_query(update: Update, context: CallbackContext):
         return
     if data == 'inicia_start':
         # Show groups where user is admin (from stored groups)
-        groups = db_exec('SELECT id, title FROM groups', fetch=True)
+        groups = store.list_groups()
         buttons = []
         for gid, title in groups:
             try:
@@ -248,11 +182,11 @@ def callback_query(update: Update, context: CallbackContext):
             page = 1
         per = 8
         offset = (page-1)*per
-        rows = db_exec('SELECT id, type, group_id, admin_id, created_at FROM games ORDER BY created_at DESC LIMIT ? OFFSET ?', (per, offset), fetch=True)
+        rows = store.recent_games(per, offset)
         if not rows:
             q.edit_message_text('Nessuna partita trovata.')
             return
-        lines = [f"{r[0]} | {r[1]} | group:{r[2]} | admin:{r[3]} | {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r[4]))}" for r in rows]
+        lines = [f"{g.id} | {g.type} | group:{g.group_id} | admin:{g.admin_id} | {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(g.created_at))}" for g in rows]
         kb = []
         if page > 1:
             kb.append(InlineKeyboardButton('⬅️ Indietro', callback_data=f'logspartite:{page-1}'))
@@ -305,8 +239,7 @@ def start_indovinachi(bot: Bot, admin_id: int, group_id: int, word: str):
     game_id = gen_game_id()
     secret = word.strip().lower()
     created = int(time.time())
-    db_exec('INSERT INTO games (id, type, group_id, admin_id, secret, state, metadata, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-            (game_id, 'indovinachi', gid, admin_id, secret, 'active', '', created))
+    store.create_game(Game(game_id, 'indovinachi', gid, admin_id, secret, 'active', '', created))
     # Post in group
     msg = bot.send_message(gid, f"🔔 Nuova partita di Indovina Chi! Gli indizi verranno pubblicati durante la partita.\nID Partita: {game_id}")
     try:
@@ -321,8 +254,7 @@ def start_fastgame(bot: Bot, admin_id: int, group_id: int, word: str):
     game_id = gen_game_id()
     secret = word.strip().lower()
     created = int(time.time())
-    db_exec('INSERT INTO games (id, type, group_id, admin_id, secret, state, metadata, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-            (game_id, 'fast', group_id, admin_id, secret, 'active', '', created))
+    store.create_game(Game(game_id, 'fast', group_id, admin_id, secret, 'active', '', created))
     bot.send_message(group_id, f"⚡ Fast Game iniziato! Primo che scrive la parola vince. Parola: *?*",
                      parse_mode=ParseMode.MARKDOWN)
     log_event('game_created', 'fast', {'game_id': game_id, 'group_id': group_id, 'admin_id': admin_id})
@@ -338,8 +270,7 @@ def start_blocchi(bot: Bot, admin_id: int, group_id: int, word: str):
     else:
         display = ''
     created = int(time.time())
-    db_exec('INSERT INTO games (id, type, group_id, admin_id, secret, state, metadata, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-            (game_id, 'blocchi', group_id, admin_id, secret, 'active', display, created))
+    store.create_game(Game(game_id, 'blocchi', group_id, admin_id, secret, 'active', display, created))
     bot.send_message(group_id, f"🔤 Partita di Parole a Blocchi iniziata: {display}")
     log_event('game_created', 'blocchi', {'game_id': game_id, 'group_id': group_id, 'admin_id': admin_id})
 
@@ -352,11 +283,11 @@ def indizio(update: Update, context: CallbackContext):
         return
     gid = args[0]
     desc = ' '.join(args[1:])
-    row = db_exec('SELECT group_id FROM games WHERE id=?', (gid,), fetch=True)
-    if not row:
+    game = store.get_game(gid)
+    if not game:
         update.message.reply_text('Partita non trovata.')
         return
-    group_id = row[0][0]
+    group_id = game.group_id
     try:
         context.bot.send_message(group_id, f"💡 Indizio per {gid}: {desc}")
         update.message.reply_text('Indizio inviato al gruppo.')
@@ -373,26 +304,23 @@ def group_message(update: Update, context: CallbackContext):
     gid = update.effective_chat.id
     user = update.effective_user
     # Log this message for tie-breakers (only while there are active games)
-    active = db_exec('SELECT 1 FROM games WHERE group_id=? AND state="active" LIMIT 1', (gid,), fetch=True)
-    if active:
+    if store.has_active_game(gid):
         try:
-            db_exec('INSERT INTO messages (user_id, group_id, ts) VALUES (?, ?, ?)', (user.id, gid, int(time.time())))
+            store.record_message(user.id, gid, int(time.time()))
         except Exception:
             pass
     # Check active games in this group
-    rows = db_exec('SELECT id, type, secret, metadata FROM games WHERE group_id=? AND state="active"', (gid,), fetch=True)
-    for gid_game, gtype, secret, metadata in rows:
+    for game in store.active_games_for_group(gid):
+        gid_game, gtype, secret, metadata = game.id, game.type, game.secret, game.metadata
         if gtype == 'indovinachi':
             if txt == (secret or '').lower():
-                # Win
-                award_win(user.id, gid, context.bot)
-                context.bot.send_message(gid, f"🎉 {user.first_name} ha indovinato la parola! La partita {gid_game} è conclusa.")
-                db_exec('UPDATE games SET state=? WHERE id=?', ('finished', gid_game))
+                # Win (ignored if someone else already claimed this game)
+                if award_win(user.id, gid, gid_game, context.bot) is not None:
+                    context.bot.send_message(gid, f"🎉 {user.first_name} ha indovinato la parola! La partita {gid_game} è conclusa.")
         elif gtype == 'fast':
             if txt == (secret or '').lower():
-                award_win(user.id, gid, context.bot)
-                context.bot.send_message(gid, f"⚡ {user.first_name} ha vinto il Fast Game! Parola corretta.")
-                db_exec('UPDATE games SET state=? WHERE id=?', ('finished', gid_game))
+                if award_win(user.id, gid, gid_game, context.bot) is not None:
+                    context.bot.send_message(gid, f"⚡ {user.first_name} ha vinto il Fast Game! Parola corretta.")
         elif gtype == 'blocchi':
             # metadata stores display
             display = metadata
@@ -407,7 +335,7 @@ def group_message(update: Update, context: CallbackContext):
                         changed = True
                 if changed:
                     display = ''.join(new_display)
-                    db_exec('UPDATE games SET metadata=? WHERE id=?', (display, gid_game))
+                    store.set_game_metadata(gid_game, display)
                     context.bot.send_message(gid, f"{display}")
                     # Check reveal count
                     unrevealed = display.count('_')
@@ -419,36 +347,25 @@ def group_message(update: Update, context: CallbackContext):
                 # else ignore
 
 def finish_blocchi(game_id, bot: Bot):
-    row = db_exec('SELECT group_id, secret, state FROM games WHERE id=?', (game_id,), fetch=True)
-    if not row:
-        return
-    group_id, secret, state = row[0]
-    if state != 'active':
-        return
-    bot.send_message(group_id, f"⏱ Tempo scaduto! La parola era: {secret}")
-    db_exec('UPDATE games SET state=? WHERE id=?', ('finished', game_id))
     timers.pop(game_id, None)
+    game = store.get_game(game_id)
+    if not game or not store.finish_game(game_id):
+        return
+    bot.send_message(game.group_id, f"⏱ Tempo scaduto! La parola era: {game.secret}")
 
-def award_win(user_id, group_id, bot: Bot):
-    # record win (history)
+def award_win(user_id, group_id, game_id, bot: Bot):
+    # finish the game, record the win and update cumulative points in one step;
+    # returns None if the game was already over
     ts = int(time.time())
-    try:
-        db_exec('INSERT INTO wins (user_id, group_id, points, ts) VALUES (?, ?, ?, ?)', (user_id, group_id, POINTS_PER_WIN, ts))
-    except Exception:
-        pass
-    # update cumulative points per group
-    row = db_exec('SELECT points FROM points WHERE user_id=? AND group_id=?', (user_id, group_id), fetch=True)
-    if row:
-        pts = row[0][0] + POINTS_PER_WIN
-        db_exec('UPDATE points SET points=? WHERE user_id=? AND group_id=?', (pts, user_id, group_id))
-    else:
-        pts = POINTS_PER_WIN
-        db_exec('INSERT INTO points (user_id, group_id, points) VALUES (?, ?, ?)', (user_id, group_id, pts))
+    pts = store.claim_win(game_id, user_id, group_id, POINTS_PER_WIN, ts)
+    if pts is None:
+        return None
     # Log win
     try:
         log_event('win', f'user {user_id} won in {group_id}', {'user_id': user_id, 'group_id': group_id, 'new_points': pts})
     except Exception:
         pass
+    return pts
 
 # Commands
 
@@ -464,12 +381,13 @@ def guida(update: Update, context: CallbackContext):
 
 @restricted_to_staff
 def partite(update: Update, context: CallbackContext):
-    rows = db_exec('SELECT id, type, group_id, created_at FROM games WHERE state="active"', fetch=True)
+    rows = store.active_games()
     if not rows:
         update.message.reply_text('Nessuna partita attiva.')
         return
     msg_lines = ['Partite attive:']
-    for gid, gtype, group_id, created in rows:
+    for game in rows:
+        gid, gtype, group_id = game.id, game.type, game.group_id
         try:
             chat = context.bot.get_chat(group_id)
             title = chat.title or group_id
@@ -486,7 +404,7 @@ def logs_command(update: Update, context: CallbackContext):
     per = 10
     page = 1
     offset = 0
-    rows = db_exec('SELECT id, type, text, ts FROM logs ORDER BY id DESC LIMIT ? OFFSET ?', (per, offset), fetch=True)
+    rows = store.recent_logs(per, offset)
     if not rows:
         update.message.reply_text('Nessun log disponibile.')
         return
@@ -502,11 +420,11 @@ def logspartite_command(update: Update, context: CallbackContext):
     per = 8
     page = 1
     offset = 0
-    rows = db_exec('SELECT id, type, group_id, admin_id, created_at FROM games ORDER BY created_at DESC LIMIT ? OFFSET ?', (per, offset), fetch=True)
+    rows = store.recent_games(per, offset)
     if not rows:
         update.message.reply_text('Nessuna partita trovata.')
         return
-    lines = [f"{r[0]} | {r[1]} | group:{r[2]} | admin:{r[3]} | {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r[4]))}" for r in rows]
+    lines = [f"{g.id} | {g.type} | group:{g.group_id} | admin:{g.admin_id} | {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(g.created_at))}" for g in rows]
     kb = [
         [InlineKeyboardButton('➡️ Avanti', callback_data='logspartite:2')]
     ]
@@ -539,7 +457,7 @@ def classifica(update: Update, context: CallbackContext):
     else:
         update.message.reply_text('Specifica il gruppo con /classifica [group_id] quando usi in privato.')
         return
-    rows = db_exec('SELECT user_id, points FROM points WHERE group_id=? ORDER BY points DESC LIMIT 20', (group_id,), fetch=True)
+    rows = store.top_points(group_id, 20)
     if not rows:
         update.message.reply_text('Nessuna classifica disponibile per questo gruppo.')
         return
@@ -560,7 +478,7 @@ def classifica(update: Update, context: CallbackContext):
 def weekly_champion_and_announce(bot: Bot):
     now = int(time.time())
     cutoff = now - 7 * 24 * 3600
-    rows = db_exec('SELECT user_id, SUM(points) FROM wins WHERE ts>=? GROUP BY user_id ORDER BY SUM(points) DESC', (cutoff,), fetch=True)
+    rows = store.win_totals_since(cutoff)
     if not rows:
         return
     top_points = rows[0][1]
@@ -572,8 +490,7 @@ def weekly_champion_and_announce(bot: Bot):
         best = None
         best_msgs = -1
         for uid in candidates:
-            cnt_row = db_exec('SELECT COUNT(*) FROM messages WHERE user_id=? AND ts>=?', (uid, cutoff), fetch=True)
-            cnt = cnt_row[0][0] if cnt_row else 0
+            cnt = store.count_messages(uid, cutoff)
             if cnt > best_msgs:
                 best_msgs = cnt
                 best = uid
@@ -587,7 +504,7 @@ def weekly_champion_and_announce(bot: Bot):
         name = str(champion)
     text = f"🏆 Campione settimanale: {name}!\nPunti: {top_points} ({quack} QuackPoints)"
     # send to all known groups
-    groups = db_exec('SELECT id FROM groups', fetch=True)
+    groups = store.list_groups()
     for g in groups:
         try:
             bot.send_message(g[0], text)
@@ -602,11 +519,11 @@ def stop_game(update: Update, context: CallbackContext):
         update.message.reply_text('Usage: /stop [ID]')
         return
     gid = args[0]
-    row = db_exec('SELECT admin_id, group_id, state FROM games WHERE id=?', (gid,), fetch=True)
-    if not row:
+    game = store.get_game(gid)
+    if not game:
         update.message.reply_text('Partita non trovata.')
         return
-    admin_id, group_id, state = row[0]
+    admin_id, group_id = game.admin_id, game.group_id
     # Only group admins or bot staff can stop
     try:
         admins = context.bot.get_chat_administrators(group_id)
@@ -616,13 +533,13 @@ def stop_game(update: Update, context: CallbackContext):
     if user.id != admin_id and user.id not in STAFF_ADMINS and not is_admin:
         update.message.reply_text('Non hai i permessi per fermare questa partita.')
         return
-    db_exec('UPDATE games SET state=? WHERE id=?', ('finished', gid))
+    store.finish_game(gid)
     update.message.reply_text('Partita fermata.')
 
 # ===== Main =====
 
 def main():
-    init_db()
+    store.init()
     updater = Updater(BOT_TOKEN, use_context=True)
     dp = updater.dispatcher
 
@@ -0,0 +1,452 @@
+"""
+Storage backends for QuackTV Games.
+
+All persistence goes through a Repository. Two implementations ship:
+- SqliteRepository: the on-disk SQLite database used in production
+- MemoryRepository: indexed Python structures, no disk I/O (tests, benchmarks)
+
+Pick one with create_repository('sqlite' | 'memory').
+"""
+
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple, defaultdict
+from itertools import count
+
+Game = namedtuple('Game', 'id type group_id admin_id secret state metadata created_at')
+
+
+class Repository(ABC):
+    """Operations the bot needs from its storage. Subclasses implement all of them."""
+
+    @abstractmethod
+    def init(self):
+        """Prepare the storage (create tables, etc.)."""
+        raise NotImplementedError
+
+    # ===== groups =====
+    @abstractmethod
+    def save_group(self, group_id, title, stored_at):
+        """Store or replace a group. Returns nothing."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_groups(self):
+        """Return [(group_id, title)] for every known group."""
+        raise NotImplementedError
+
+    # ===== games =====
+    @abstractmethod
+    def create_game(self, game):
+        """Insert a new Game. Returns nothing; fails if the id already exists."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_game(self, game_id):
+        """Return the Game with this id, or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def has_active_game(self, group_id):
+        """Return True if the group has at least one active game."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def active_games_for_group(self, group_id):
+        """Return the list of active Games in the group."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def active_games(self):
+        """Return the list of active Games across all groups."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def recent_games(self, limit, offset=0):
+        """Return games, newest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_game_metadata(self, game_id, metadata):
+        """Replace the metadata string of a game. Returns nothing."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def finish_game(self, game_id):
+        """Mark the game finished. Return True if it was still active."""
+        raise NotImplementedError
+
+    # ===== points / wins =====
+    @abstractmethod
+    def claim_win(self, game_id, user_id, group_id, points, ts):
+        """Finish an active game and credit the winner in one step.
+
+        Returns the winner's new point total for the group, or None if the
+        game was no longer active (someone else already won or it was stopped).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def top_points(self, group_id, limit=20):
+        """Return [(user_id, points)] for the group, highest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def win_totals_since(self, since):
+        """Return [(user_id, total_points)] of wins since ts, highest first."""
+        raise NotImplementedError
+
+    # ===== activity =====
+    @abstractmethod
+    def record_message(self, user_id, group_id, ts):
+        """Record one message for tie-breakers. Returns nothing."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_messages(self, user_id, since):
+        """Return the number of the user's messages since ts."""
+        raise NotImplementedError
+
+    # ===== logs =====
+    @abstractmethod
+    def add_log(self, event_type, text, data, ts):
+        """Append a log entry. Returns nothing."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def recent_logs(self, limit, offset=0):
+        """Return [(id, type, text, ts)], newest first."""
+        raise NotImplementedError
+
+
+class SqliteRepository(Repository):
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def _exec(self, query, params=(), fetch=False):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(query, params)
+        res = None
+        if fetch:
+            res = c.fetchall()
+        conn.commit()
+        conn.close()
+        return res
+
+    def init(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS groups (
+                id INTEGER PRIMARY KEY,
+                title TEXT,
+                stored_at INTEGER
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS games (
+                id TEXT PRIMARY KEY,
+                type TEXT,
+                group_id INTEGER,
+                admin_id INTEGER,
+                secret TEXT,
+                state TEXT,
+                metadata TEXT,
+                created_at INTEGER
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS points (
+                user_id INTEGER,
+                group_id INTEGER,
+                points INTEGER,
+                PRIMARY KEY (user_id, group_id)
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS wins (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                group_id INTEGER,
+                points INTEGER,
+                ts INTEGER
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                group_id INTEGER,
+                ts INTEGER
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT,
+                text TEXT,
+                data TEXT,
+                ts INTEGER
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    # ===== groups =====
+    def save_group(self, group_id, title, stored_at):
+        self._exec('INSERT OR REPLACE INTO groups (id, title, stored_at) VALUES (?, ?, ?)',
+                   (group_id, title, stored_at))
+
+    def list_groups(self):
+        return self._exec('SELECT id, title FROM groups', fetch=True)
+
+    # ===== games =====
+    def create_game(self, game):
+        self._exec('INSERT INTO games (id, type, group_id, admin_id, secret, state, metadata, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                   tuple(game))
+
+    def get_game(self, game_id):
+        rows = self._exec('SELECT id, type, group_id, admin_id, secret, state, metadata, created_at FROM games WHERE id=?',
+                          (game_id,), fetch=True)
+        return Game(*rows[0]) if rows else None
+
+    def has_active_game(self, group_id):
+        rows = self._exec('SELECT 1 FROM games WHERE group_id=? AND state=? LIMIT 1', (group_id, 'active'), fetch=True)
+        return bool(rows)
+
+    def active_games_for_group(self, group_id):
+        rows = self._exec('SELECT id, type, group_id, admin_id, secret, state, metadata, created_at FROM games WHERE group_id=? AND state=?',
+                          (group_id, 'active'), fetch=True)
+        return [Game(*r) for r in rows]
+
+    def active_games(self):
+        rows = self._exec('SELECT id, type, group_id, admin_id, secret, state, metadata, created_at FROM games WHERE state=?',
+                          ('active',), fetch=True)
+        return [Game(*r) for r in rows]
+
+    def recent_games(self, limit, offset=0):
+        rows = self._exec('SELECT id, type, group_id, admin_id, secret, state, metadata, created_at FROM games ORDER BY created_at DESC LIMIT ? OFFSET ?',
+                          (limit, offset), fetch=True)
+        return [Game(*r) for r in rows]
+
+    def set_game_metadata(self, game_id, metadata):
+        self._exec('UPDATE games SET metadata=? WHERE id=?', (metadata, game_id))
+
+    def finish_game(self, game_id):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('UPDATE games SET state=? WHERE id=? AND state=?', ('finished', game_id, 'active'))
+            conn.commit()
+            return c.rowcount > 0
+        finally:
+            conn.close()
+
+    # ===== points / wins =====
+    def claim_win(self, game_id, user_id, group_id, points, ts):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('UPDATE games SET state=? WHERE id=? AND state=?', ('finished', game_id, 'active'))
+            if c.rowcount == 0:
+                conn.rollback()
+                return None
+            c.execute('INSERT INTO wins (user_id, group_id, points, ts) VALUES (?, ?, ?, ?)', (user_id, group_id, points, ts))
+            c.execute('INSERT OR IGNORE INTO points (user_id, group_id, points) VALUES (?, ?, 0)', (user_id, group_id))
+            c.execute('UPDATE points SET points=points+? WHERE user_id=? AND group_id=?', (points, user_id, group_id))
+            c.execute('SELECT points FROM points WHERE user_id=? AND group_id=?', (user_id, group_id))
+            total = c.fetchone()[0]
+            conn.commit()
+            return total
+        finally:
+            conn.close()
+
+    def top_points(self, group_id, limit=20):
+        return self._exec('SELECT user_id, points FROM points WHERE group_id=? ORDER BY points DESC LIMIT ?',
+                          (group_id, limit), fetch=True)
+
+    def win_totals_since(self, since):
+        return self._exec('SELECT user_id, SUM(points) FROM wins WHERE ts>=? GROUP BY user_id ORDER BY SUM(points) DESC',
+                          (since,), fetch=True)
+
+    # ===== activity =====
+    def record_message(self, user_id, group_id, ts):
+        self._exec('INSERT INTO messages (user_id, group_id, ts) VALUES (?, ?, ?)', (user_id, group_id, ts))
+
+    def count_messages(self, user_id, since):
+        rows = self._exec('SELECT COUNT(*) FROM messages WHERE user_id=? AND ts>=?', (user_id, since), fetch=True)
+        return rows[0][0] if rows else 0
+
+    # ===== logs =====
+    def add_log(self, event_type, text, data, ts):
+        self._exec('INSERT INTO logs (type, text, data, ts) VALUES (?, ?, ?, ?)', (event_type, text, data, ts))
+
+    def recent_logs(self, limit, offset=0):
+        return self._exec('SELECT id, type, text, ts FROM logs ORDER BY id DESC LIMIT ? OFFSET ?',
+                          (limit, offset), fetch=True)
+
+
+class MemoryRepository(Repository):
+    """Everything lives in process memory and is lost on exit.
+
+    Hot lookups are indexed: active games per group, points per group,
+    and time-ordered lists for wins, messages and games so range queries
+    use bisect instead of a full scan.
+    """
+
+    def __init__(self):
+        # timers fire finish_blocchi from another thread
+        self._lock = threading.RLock()
+        self._groups = {}                       # group_id -> (title, stored_at)
+        self._games = {}                        # game_id -> Game
+        self._games_by_created = []             # sorted [(created_at, seq, game_id)]
+        self._game_seq = count()
+        self._active_by_group = defaultdict(dict)   # group_id -> {game_id: None}, insertion ordered
+        self._points = defaultdict(dict)        # group_id -> {user_id: points}
+        self._win_ts = []                       # sorted ts, parallel to _wins
+        self._wins = []                         # [(user_id, group_id, points, ts)]
+        self._messages = defaultdict(list)      # user_id -> sorted [ts]
+        self._logs = []                         # [(id, type, text, data, ts)]
+
+    def init(self):
+        pass
+
+    # ===== groups =====
+    def save_group(self, group_id, title, stored_at):
+        with self._lock:
+            self._groups[group_id] = (title, stored_at)
+
+    def list_groups(self):
+        with self._lock:
+            return [(gid, title) for gid, (title, _) in self._groups.items()]
+
+    # ===== games =====
+    def create_game(self, game):
+        game = Game(*game)
+        with self._lock:
+            if game.id in self._games:
+                raise ValueError(f'game {game.id} already exists')
+            self._games[game.id] = game
+            insort(self._games_by_created, (game.created_at, next(self._game_seq), game.id))
+            if game.state == 'active':
+                self._active_by_group[game.group_id][game.id] = None
+
+    def get_game(self, game_id):
+        with self._lock:
+            return self._games.get(game_id)
+
+    def has_active_game(self, group_id):
+        with self._lock:
+            return bool(self._active_by_group.get(group_id))
+
+    def active_games_for_group(self, group_id):
+        with self._lock:
+            return [self._games[g] for g in self._active_by_group.get(group_id, ())]
+
+    def active_games(self):
+        with self._lock:
+            return [self._games[g] for ids in self._active_by_group.values() for g in ids]
+
+    def recent_games(self, limit, offset=0):
+        with self._lock:
+            end = len(self._games_by_created) - offset
+            start = max(end - limit, 0)
+            if end <= 0:
+                return []
+            return [self._games[g] for _, _, g in reversed(self._games_by_created[start:end])]
+
+    def set_game_metadata(self, game_id, metadata):
+        with self._lock:
+            game = self._games.get(game_id)
+            if game:
+                self._games[game_id] = game._replace(metadata=metadata)
+
+    def _finish_locked(self, game_id):
+        game = self._games.get(game_id)
+        if not game or game.state != 'active':
+            return False
+        self._games[game_id] = game._replace(state='finished')
+        active = self._active_by_group.get(game.group_id)
+        if active is not None:
+            active.pop(game_id, None)
+            if not active:
+                del self._active_by_group[game.group_id]
+        return True
+
+    def finish_game(self, game_id):
+        with self._lock:
+            return self._finish_locked(game_id)
+
+    # ===== points / wins =====
+    def claim_win(self, game_id, user_id, group_id, points, ts):
+        with self._lock:
+            if not self._finish_locked(game_id):
+                return None
+            i = bisect_right(self._win_ts, ts)
+            self._win_ts.insert(i, ts)
+            self._wins.insert(i, (user_id, group_id, points, ts))
+            group_points = self._points[group_id]
+            total = group_points.get(user_id, 0) + points
+            group_points[user_id] = total
+            return total
+
+    def top_points(self, group_id, limit=20):
+        with self._lock:
+            group_points = self._points.get(group_id)
+            if not group_points:
+                return []
+            return heapq.nlargest(limit, group_points.items(), key=lambda item: item[1])
+
+    def win_totals_since(self, since):
+        with self._lock:
+            totals = defaultdict(int)
+            for user_id, _, points, _ in self._wins[bisect_left(self._win_ts, since):]:
+                totals[user_id] += points
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+    # ===== activity =====
+    def record_message(self, user_id, group_id, ts):
+        with self._lock:
+            insort(self._messages[user_id], ts)
+
+    def count_messages(self, user_id, since):
+        with self._lock:
+            stamps = self._messages.get(user_id)
+            if not stamps:
+                return 0
+            return len(stamps) - bisect_left(stamps, since)
+
+    # ===== logs =====
+    def add_log(self, event_type, text, data, ts):
+        with self._lock:
+            self._logs.append((len(self._logs) + 1, event_type, text, data, ts))
+
+    def recent_logs(self, limit, offset=0):
+        with self._lock:
+            end = len(self._logs) - offset
+            if end <= 0:
+                return []
+            start = max(end - limit, 0)
+            return [(r[0], r[1], r[2], r[4]) for r in reversed(self._logs[start:end])]
+
+
+BACKENDS = ('sqlite', 'memory')
+
+
+def create_repository(backend, db_path=None):
+    """Build the repository for the configured backend name."""
+    if backend == 'sqlite':
+        if not db_path:
+            raise ValueError('sqlite backend requires db_path')
+        return SqliteRepository(db_path)
+    if backend == 'memory':
+        return MemoryRepository()
+    raise ValueError(f"Unknown storage backend {backend!r}, expected one of: {', '.join(BACKENDS)}")
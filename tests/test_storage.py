@@ -0,0 +1,184 @@
+import importlib
+import sys
+
+import pytest
+
+from storage import Game, MemoryRepository, SqliteRepository, create_repository
+
+
+def make_repos(tmp_path):
+    sqlite = SqliteRepository(str(tmp_path / 'test.db'))
+    memory = MemoryRepository()
+    for repo in (sqlite, memory):
+        repo.init()
+    return sqlite, memory
+
+
+@pytest.fixture
+def repos(tmp_path):
+    return make_repos(tmp_path)
+
+
+def run_both(repos, fn):
+    """Run fn on every backend and check they all return the same thing."""
+    results = [fn(repo) for repo in repos]
+    for res in results[1:]:
+        assert res == results[0]
+    return results[0]
+
+
+def add_games(repo, n, group_id=-1, start=100):
+    for i in range(n):
+        repo.create_game(Game(f'#{i}', 'fast', group_id, 9, 'parola', 'active', '', start + i))
+
+
+def test_create_repository():
+    assert isinstance(create_repository('memory'), MemoryRepository)
+    assert isinstance(create_repository('sqlite', 'x.db'), SqliteRepository)
+    with pytest.raises(ValueError):
+        create_repository('redis')
+
+
+def test_groups(repos):
+    def ops(repo):
+        repo.save_group(-1, 'primo', 1)
+        repo.save_group(-2, 'secondo', 2)
+        repo.save_group(-1, 'rinominato', 3)
+        return sorted(repo.list_groups())
+    assert run_both(repos, ops) == [(-2, 'secondo'), (-1, 'rinominato')]
+
+
+def test_games(repos):
+    def ops(repo):
+        add_games(repo, 3)
+        repo.create_game(Game('#x', 'blocchi', -2, 9, 'ciao', 'active', 'c___', 50))
+        repo.set_game_metadata('#x', 'ci__')
+        return (
+            repo.get_game('#x'),
+            repo.get_game('#missing'),
+            repo.has_active_game(-1),
+            repo.has_active_game(-3),
+            sorted(g.id for g in repo.active_games_for_group(-1)),
+            sorted(g.id for g in repo.active_games()),
+        )
+    game, missing, active, inactive, group_ids, all_ids = run_both(repos, ops)
+    assert game.metadata == 'ci__'
+    assert missing is None
+    assert active and not inactive
+    assert group_ids == ['#0', '#1', '#2']
+    assert all_ids == ['#0', '#1', '#2', '#x']
+
+
+def test_finish_game(repos):
+    def ops(repo):
+        add_games(repo, 2)
+        first = repo.finish_game('#0')
+        again = repo.finish_game('#0')
+        return first, again, repo.get_game('#0').state, [g.id for g in repo.active_games_for_group(-1)]
+    assert run_both(repos, ops) == (True, False, 'finished', ['#1'])
+
+
+def test_claim_win_only_once(repos):
+    def ops(repo):
+        add_games(repo, 2)
+        first = repo.claim_win('#0', 7, -1, 5, 1000)
+        second = repo.claim_win('#0', 8, -1, 5, 1001)
+        third = repo.claim_win('#1', 7, -1, 5, 1002)
+        return first, second, third, repo.top_points(-1), repo.has_active_game(-1)
+    assert run_both(repos, ops) == (5, None, 10, [(7, 10)], False)
+
+
+def test_claim_win_on_stopped_game(repos):
+    def ops(repo):
+        add_games(repo, 1)
+        repo.finish_game('#0')
+        return repo.claim_win('#0', 7, -1, 5, 1000), repo.top_points(-1)
+    assert run_both(repos, ops) == (None, [])
+
+
+def test_recent_games_paging(repos):
+    def ops(repo):
+        add_games(repo, 5)
+        return [
+            [g.id for g in repo.recent_games(2)],
+            [g.id for g in repo.recent_games(2, 2)],
+            [g.id for g in repo.recent_games(2, 4)],
+            [g.id for g in repo.recent_games(2, 5)],
+            [g.id for g in repo.recent_games(2, 50)],
+        ]
+    assert run_both(repos, ops) == [['#4', '#3'], ['#2', '#1'], ['#0'], [], []]
+
+
+def test_recent_logs_paging(repos):
+    def ops(repo):
+        for i in range(5):
+            repo.add_log('evento', f'log {i}', None, 100 + i)
+        return [
+            repo.recent_logs(3),
+            repo.recent_logs(3, 3),
+            repo.recent_logs(3, 5),
+            repo.recent_logs(3, 50),
+        ]
+    first, second, end, past_end = run_both(repos, ops)
+    assert [r[2] for r in first] == ['log 4', 'log 3', 'log 2']
+    assert [r[2] for r in second] == ['log 1', 'log 0']
+    assert first[0] == (5, 'evento', 'log 4', 104)
+    assert end == [] and past_end == []
+
+
+def test_win_totals_since_boundary(repos):
+    def ops(repo):
+        add_games(repo, 4)
+        repo.claim_win('#0', 7, -1, 5, 999)
+        repo.claim_win('#1', 7, -1, 5, 1000)
+        repo.claim_win('#2', 8, -2, 5, 1000)
+        repo.claim_win('#3', 8, -1, 5, 1001)
+        return (
+            sorted(repo.win_totals_since(1000)),
+            sorted(repo.win_totals_since(1001)),
+            repo.win_totals_since(1002),
+        )
+    assert run_both(repos, ops) == ([(7, 5), (8, 10)], [(8, 5)], [])
+
+
+def test_win_totals_order(repos):
+    def ops(repo):
+        add_games(repo, 3)
+        repo.claim_win('#0', 7, -1, 5, 1000)
+        repo.claim_win('#1', 8, -1, 5, 1000)
+        repo.claim_win('#2', 8, -1, 5, 1000)
+        return repo.win_totals_since(0)
+    assert run_both(repos, ops) == [(8, 10), (7, 5)]
+
+
+def test_top_points_limit(repos):
+    def ops(repo):
+        add_games(repo, 6)
+        for i, user_id in enumerate([1, 2, 2, 3, 3, 3]):
+            repo.claim_win(f'#{i}', user_id, -1, 5, 1000 + i)
+        return repo.top_points(-1, 2), repo.top_points(-1), repo.top_points(-2)
+    assert run_both(repos, ops) == ([(3, 15), (2, 10)], [(3, 15), (2, 10), (1, 5)], [])
+
+
+def test_count_messages(repos):
+    def ops(repo):
+        for ts in (30, 10, 20, 20):
+            repo.record_message(7, -1, ts)
+        repo.record_message(8, -1, 20)
+        return repo.count_messages(7, 20), repo.count_messages(7, 31), repo.count_messages(9, 0)
+    assert run_both(repos, ops) == (3, 0, 0)
+
+
+def test_award_win_returns_points(monkeypatch):
+    pytest.importorskip('telegram')
+    monkeypatch.setenv('BOT_TOKEN', 'test-token')
+    monkeypatch.setenv('STORAGE_BACKEND', 'memory')
+    sys.modules.pop('bot', None)
+    bot = importlib.import_module('bot')
+    try:
+        bot.store.create_game(Game('#1', 'fast', -5, 9, 'parola', 'active', '', 100))
+        assert bot.award_win(7, -5, '#1', None) == bot.POINTS_PER_WIN
+        assert bot.award_win(8, -5, '#1', None) is None
+        assert bot.store.top_points(-5) == [(7, bot.POINTS_PER_WIN)]
+    finally:
+        sys.modules.pop('bot', None)